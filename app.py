@@ -1,11 +1,27 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, abort
+from flask.json.provider import DefaultJSONProvider
 from db_manager import Database
 from network_scanner import NetworkScanner
-import json
+import orjson
 from datetime import datetime
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.json = OrjsonProvider(app)
 
 # Initialize database and scanner
 db = Database()
@@ -16,7 +32,7 @@ def index():
     """Main dashboard"""
     stats = db.get_statistics()
     recent_scans = db.get_scan_sessions(limit=5)
-    recent_devices = db.get_all_devices()[:10]
+    recent_devices = db.get_all_devices(limit=10)
     
     return render_template('index.html', 
                          stats=stats, 
@@ -47,8 +63,8 @@ def scan_network():
 def scan_results(session_id):
     """Show results of a specific scan"""
     devices = db.get_devices_from_session(session_id)
+    current_session = db.get_scan_session(session_id)
     scan_sessions = db.get_scan_sessions()
-    current_session = next((s for s in scan_sessions if s['id'] == session_id), None)
     
     return render_template('devices.html', 
                          devices=devices, 
@@ -66,6 +82,8 @@ def all_devices():
 def device_detail(device_id):
     """Show detailed information for a device"""
     device = db.get_device_detail(device_id)
+    if device is None:
+        abort(404)
     return render_template('device_detail.html', device=device)
 
 @app.route('/history')
@@ -103,9 +121,12 @@ def format_datetime(value):
 @app.template_filter('from_json')
 def from_json(value):
     """Parse JSON string"""
+    # Values that are not strings have already been parsed
+    if not isinstance(value, (str, bytes)):
+        return value
     try:
-        return json.loads(value)
-    except:
+        return orjson.loads(value)
+    except ValueError:
         return value
 
 if __name__ == '__main__':
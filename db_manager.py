@@ -1,473 +1,675 @@
 import sqlite3
-import json
+import orjson
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import namedtuple
 from datetime import datetime
-from contextlib import contextmanager
+from concurrent.futures import Future, InvalidStateError
+from contextlib import closing, contextmanager
+from functools import lru_cache, partial
 
-class Database:
-    def __init__(self, db_path='network_inventory.db'):
-        self.db_path = db_path
-        self.init_database()
-    
-    def init_database(self):
-        """Initialize database tables"""
-        with self.get_connection() as conn:
-            # Scan sessions table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS scan_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    network_range TEXT,
-                    total_devices INTEGER,
-                    duration_seconds REAL
-                )
-            ''')
-            
-            # Devices table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS devices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    scan_session_id INTEGER,
-                    ip_address TEXT NOT NULL,
-                    mac_address TEXT,
-                    hostname TEXT,
-                    vendor TEXT,
-                    os_guess TEXT,
-                    device_type TEXT,
-                    status TEXT,
-                    first_seen DATETIME,
-                    last_seen DATETIME,
-                    FOREIGN KEY (scan_session_id) REFERENCES scan_sessions (id)
-                )
-            ''')
-            
-            # Services table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS services (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    device_id INTEGER,
-                    port INTEGER,
-                    service_name TEXT,
-                    version TEXT,
-                    product TEXT,
-                    FOREIGN KEY (device_id) REFERENCES devices (id)
-                )
-            ''')
-            
-            # Device history table for tracking changes
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS device_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    device_id INTEGER,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    ip_address TEXT,
-                    status TEXT,
-                    open_ports TEXT,
-                    FOREIGN KEY (device_id) REFERENCES devices (id)
-                )
-            ''')
-            
-            conn.commit()
+# Applied to every connection right after it is opened. page_size only
+# takes effect on a new, empty database file, so it has to come before
+# journal_mode=WAL, which writes the file header
+_CONNECTION_PRAGMAS = (
+    'PRAGMA page_size=8192',
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-64000',
+    'PRAGMA mmap_size=1073741824',
+    'PRAGMA foreign_keys=ON',
+)
+
+# One scanned device as passed to save_scan_session, in devices column
+# order; services is a list of (port, service, version, product) tuples.
+# first_seen and last_seen are stamped by the database when it is saved
+DeviceRow = namedtuple('DeviceRow', 'ip_address mac_address hostname vendor os_guess device_type status services')
+
+# Size of each connection's prepared statement cache
+_CACHED_STATEMENTS = 256
+
+# Queued scan saves the writer thread commits together
+_WRITE_BATCH = 16
+
+# Seconds save_scan_session waits for the writer before giving up
+_SAVE_TIMEOUT = 60
+
+# Idle connections kept open for reuse
+_POOL_SIZE = 8
+
+# Seconds a cached dashboard query result may be served for
+_CACHE_TTL = 10
+
+# Stored in PRAGMA user_version once init_database has run; bump it
+# whenever the schema or indexes below change
+_SCHEMA_VERSION = 3
+
+# Schema, run by init_database
+_SQL_SCHEMA = '''
+    -- Scan sessions table
+    CREATE TABLE IF NOT EXISTS scan_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        network_range TEXT,
+        total_devices INTEGER,
+        duration_seconds REAL
+    );
     
-    @contextmanager
-    def get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        try:
-            yield conn
-        finally:
-            conn.close()
+    -- Devices table
+    CREATE TABLE IF NOT EXISTS devices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_session_id INTEGER,
+        ip_address TEXT NOT NULL,
+        mac_address TEXT,
+        hostname TEXT,
+        vendor TEXT,
+        os_guess TEXT,
+        device_type TEXT,
+        status TEXT,
+        first_seen DATETIME,
+        last_seen DATETIME,
+        FOREIGN KEY (scan_session_id) REFERENCES scan_sessions (id)
+    );
     
-    def save_scan_session(self, network_range, devices, duration):
-        """Save a complete scan session to database"""
-        with self.get_connection() as conn:
-            # Insert scan session
-            cursor = conn.execute('''
-                INSERT INTO scan_sessions (network_range, total_devices, duration_seconds)
-                VALUES (?, ?, ?)
-            ''', (network_range, len(devices), duration))
-            
-            session_id = cursor.lastrowid
-            
-            # Insert devices and their services
-            for device in devices:
-                # Insert or update device
-                cursor = conn.execute('''
-                    INSERT OR REPLACE INTO devices 
-                    (scan_session_id, ip_address, mac_address, hostname, vendor, os_guess, device_type, status, first_seen, last_seen)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 
-                            COALESCE((SELECT first_seen FROM devices WHERE ip_address = ?), CURRENT_TIMESTAMP),
-                            CURRENT_TIMESTAMP)
-                ''', (session_id, device['ip_address'], device['mac_address'], device['hostname'], 
-                      device['vendor'], device['os_guess'], device['device_type'], device['status'],
-                      device['ip_address']))
-                
-                device_id = cursor.lastrowid
-                if not device_id:
-                    # If it was an UPDATE, get the existing device ID
-                    cursor = conn.execute('SELECT id FROM devices WHERE ip_address = ?', (device['ip_address'],))
-                    result = cursor.fetchone()
-                    device_id = result['id'] if result else None
-                
-                # Save device history
-                open_ports = json.dumps([service['port'] for service in device['services']])
-                conn.execute('''
-                    INSERT INTO device_history (device_id, ip_address, status, open_ports)
-                    VALUES (?, ?, ?, ?)
-                ''', (device_id, device['ip_address'], device['status'], open_ports))
-                
-                # Clear existing services for this device
-                conn.execute('DELETE FROM services WHERE device_id = ?', (device_id,))
-                
-                # Insert new services
-                for service in device['services']:
-                    conn.execute('''
-                        INSERT INTO services (device_id, port, service_name, version, product)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (device_id, service['port'], service['service'], service['version'], service['product']))
-            
-            conn.commit()
-            return session_id
+    -- Services table
+    CREATE TABLE IF NOT EXISTS services (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id INTEGER,
+        port INTEGER,
+        service_name TEXT,
+        version TEXT,
+        product TEXT,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    );
     
-    def get_scan_sessions(self, limit=10):
-        """Get recent scan sessions"""
-        with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT * FROM scan_sessions 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+    -- Device history table for tracking changes
+    CREATE TABLE IF NOT EXISTS device_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        ip_address TEXT,
+        status TEXT,
+        open_ports TEXT,
+        scan_session_id INTEGER,
+        mac_address TEXT,
+        hostname TEXT,
+        vendor TEXT,
+        os_guess TEXT,
+        device_type TEXT,
+        FOREIGN KEY (device_id) REFERENCES devices (id),
+        FOREIGN KEY (scan_session_id) REFERENCES scan_sessions (id)
+    );
+'''
+
+# device_history columns added after the original schema, with their
+# declarations for ALTER TABLE. Besides the session, history keeps what
+# each scan saw of the device, since devices only holds the latest values
+_HISTORY_ADDED_COLUMNS = (
+    ('scan_session_id', 'INTEGER REFERENCES scan_sessions (id)'),
+    ('mac_address', 'TEXT'),
+    ('hostname', 'TEXT'),
+    ('vendor', 'TEXT'),
+    ('os_guess', 'TEXT'),
+    ('device_type', 'TEXT'),
+)
+
+# Schema version 2 keeps one devices row per IP address. Older databases
+# hold a row per IP per scan: copy each row's session and details into
+# the history it belongs to, then merge each IP's rows into its most
+# recent one
+_SQL_MERGE_DUPLICATE_DEVICES = '''
+    UPDATE device_history
+    SET scan_session_id = COALESCE(device_history.scan_session_id, d.scan_session_id),
+        mac_address = d.mac_address,
+        hostname = d.hostname,
+        vendor = d.vendor,
+        os_guess = d.os_guess,
+        device_type = d.device_type
+    FROM devices d
+    WHERE d.id = device_history.device_id;
     
-    def get_devices_from_session(self, session_id):
-        """Get all devices from a specific scan session"""
-        with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT d.*, GROUP_CONCAT(s.port) as ports
-                FROM devices d
-                LEFT JOIN services s ON d.id = s.device_id
-                WHERE d.scan_session_id = ?
-                GROUP BY d.id
-            ''', (session_id,))
-            return [dict(row) for row in cursor.fetchall()]
+    DROP TABLE IF EXISTS temp.device_merge;
+    CREATE TEMP TABLE device_merge AS
+    SELECT id,
+           FIRST_VALUE(id) OVER (PARTITION BY ip_address ORDER BY last_seen DESC, id DESC) as keep_id,
+           MIN(first_seen) OVER (PARTITION BY ip_address) as first_seen
+    FROM devices;
     
-    def get_all_devices(self):
-        """Get the most recent status of all unique devices"""
-        with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT d.*, 
-                       (SELECT GROUP_CONCAT(port) FROM services WHERE device_id = d.id) as ports,
-                       (SELECT COUNT(*) FROM device_history WHERE device_id = d.id) as scan_count
-                FROM devices d
-                WHERE d.last_seen = (SELECT MAX(last_seen) FROM devices WHERE ip_address = d.ip_address)
-                ORDER BY d.last_seen DESC
-            ''')
-            return [dict(row) for row in cursor.fetchall()]
+    UPDATE devices
+    SET first_seen = (SELECT m.first_seen FROM temp.device_merge m WHERE m.id = devices.id)
+    WHERE id IN (SELECT keep_id FROM temp.device_merge);
     
-    def get_device_detail(self, device_id):
-        """Get detailed information for a specific device"""
-        with self.get_connection() as conn:
-            # Get device info
-            cursor = conn.execute('SELECT * FROM devices WHERE id = ?', (device_id,))
-            device = dict(cursor.fetchone())
-            
-            # Get services
-            cursor = conn.execute('SELECT * FROM services WHERE device_id = ?', (device_id,))
-            device['services'] = [dict(row) for row in cursor.fetchall()]
-            
-            # Get history
-            cursor = conn.execute('''
-                SELECT * FROM device_history 
-                WHERE device_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT 20
-            ''', (device_id,))
-            device['history'] = [dict(row) for row in cursor.fetchall()]
-            
-            return device
+    UPDATE device_history
+    SET device_id = (SELECT m.keep_id FROM temp.device_merge m WHERE m.id = device_history.device_id)
+    WHERE device_id IN (SELECT id FROM temp.device_merge WHERE id != keep_id);
     
-    def get_statistics(self):
-        """Get various statistics about the network"""
-        with self.get_connection() as conn:
-            stats = {}
-            
-            # Total devices ever seen
-            cursor = conn.execute('SELECT COUNT(DISTINCT ip_address) as count FROM devices')
-            stats['total_unique_devices'] = cursor.fetchone()['count']
-            
-            # Currently active devices (last 24 hours)
-            cursor = conn.execute('''
-                SELECT COUNT(DISTINCT ip_address) as count 
-                FROM devices 
-                WHERE last_seen > datetime('now', '-1 day')
-            ''')
-            stats['recently_active'] = cursor.fetchone()['count']
-            
-            # Devices by type
-            cursor = conn.execute('''
-                SELECT device_type, COUNT(*) as count 
-                FROM devices 
-                WHERE last_seen = (SELECT MAX(last_seen) FROM devices d2 WHERE d2.ip_address = devices.ip_address)
-                GROUP BY device_type
-            ''')
-            stats['devices_by_type'] = {row['device_type']: row['count'] for row in cursor.fetchall()}
-            
-            # Most common vendors
-            cursor = conn.execute('''
-                SELECT vendor, COUNT(*) as count 
-                FROM devices 
-                WHERE vendor != 'Unknown' 
-                GROUP BY vendor 
-                ORDER BY count DESC 
-                LIMIT 10
-            ''')
-            stats['top_vendors'] = {row['vendor']: row['count'] for row in cursor.fetchall()}
-            
-            # Scan history
-            cursor = conn.execute('''
-                SELECT DATE(timestamp) as date, COUNT(*) as scan_count
-                FROM scan_sessions
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-                LIMIT 7
-            ''')
-            stats['recent_scans'] = [dict(row) for row in cursor.fetchall()]
-            
-            return stats
+    DELETE FROM services WHERE device_id IN (SELECT id FROM temp.device_merge WHERE id != keep_id);
+    DELETE FROM devices WHERE id IN (SELECT id FROM temp.device_merge WHERE id != keep_id);
+    DROP TABLE temp.device_merge;
+'''
 
-import sqlite3
-import json
-from datetime import datetime
-from contextlib import contextmanager
+# History written by schema version 2 has no per-scan device details and
+# the rows they came from are gone; the device's current row is the best
+# that is left
+_SQL_FILL_HISTORY_DETAILS = '''
+    UPDATE device_history
+    SET mac_address = d.mac_address,
+        hostname = d.hostname,
+        vendor = d.vendor,
+        os_guess = d.os_guess,
+        device_type = d.device_type
+    FROM devices d
+    WHERE d.id = device_history.device_id AND device_history.device_type IS NULL;
+'''
+
+# Indexes for the per-IP and per-device lookups
+_SQL_INDEXES = '''
+    DROP INDEX IF EXISTS idx_devices_ip_lastseen;
+    DROP INDEX IF EXISTS idx_devices_session;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_devices_ip ON devices (ip_address);
+    CREATE INDEX IF NOT EXISTS idx_devices_lastseen ON devices (last_seen DESC);
+    DROP INDEX IF EXISTS idx_services_device;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_services_device_port ON services (device_id, port);
+    CREATE INDEX IF NOT EXISTS idx_history_device_ts ON device_history (device_id, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_history_session ON device_history (scan_session_id);
+    CREATE INDEX IF NOT EXISTS idx_sessions_ts ON scan_sessions (timestamp DESC);
+    ANALYZE;
+'''
+
+# Writes
+_SQL_INSERT_SCAN_SESSION = '''
+    INSERT INTO scan_sessions (network_range, total_devices, duration_seconds)
+    VALUES (?, ?, ?)
+'''
+
+_SQL_UPSERT_DEVICES = '''
+    INSERT INTO devices
+    (scan_session_id, ip_address, mac_address, hostname, vendor, os_guess, device_type, status, first_seen, last_seen)
+    VALUES {values}
+    ON CONFLICT (ip_address) DO UPDATE SET
+        scan_session_id = excluded.scan_session_id,
+        mac_address = excluded.mac_address,
+        hostname = excluded.hostname,
+        vendor = excluded.vendor,
+        os_guess = excluded.os_guess,
+        device_type = excluded.device_type,
+        status = excluded.status,
+        last_seen = excluded.last_seen
+    RETURNING id, ip_address
+'''
+
+_SQL_DEVICE_VALUES_ROW = '(?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)'
+
+# Rows per multi-row device upsert; 8 parameters per row keeps a full
+# batch under the 999 host-parameter limit of older SQLite builds
+_DEVICE_INSERT_BATCH = 100
+
+_SQL_INSERT_DEVICE_HISTORY = '''
+    INSERT INTO device_history (device_id, ip_address, status, open_ports, scan_session_id,
+                                mac_address, hostname, vendor, os_guess, device_type)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Takes a JSON list of the scanned device ids and a JSON list of their
+# [device_id, port] pairs that are still open
+_SQL_DELETE_STALE_SERVICES = '''
+    DELETE FROM services
+    WHERE device_id IN (SELECT value FROM json_each(?))
+      AND (device_id, port) NOT IN (
+          SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+      )
+'''
+
+_SQL_UPSERT_SERVICE = '''
+    INSERT INTO services (device_id, port, service_name, version, product)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (device_id, port) DO UPDATE SET
+        service_name = excluded.service_name,
+        version = excluded.version,
+        product = excluded.product
+    WHERE (service_name, version, product) IS NOT (excluded.service_name, excluded.version, excluded.product)
+'''
+
+# Reads
+_SQL_GET_SCAN_SESSIONS = '''
+    SELECT * FROM scan_sessions
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+_SQL_GET_SCAN_SESSION = 'SELECT * FROM scan_sessions WHERE id = ?'
+
+_SQL_GET_DEVICES_FROM_SESSION = '''
+    SELECT d.id, h.scan_session_id, h.ip_address, h.mac_address, h.hostname, h.vendor, h.os_guess,
+           h.device_type, h.status, d.first_seen, h.timestamp as last_seen,
+           (SELECT GROUP_CONCAT(value) FROM json_each(h.open_ports)) as ports
+    FROM device_history h
+    JOIN devices d ON d.id = h.device_id
+    WHERE h.scan_session_id = ?
+    ORDER BY h.id
+'''
+
+_SQL_GET_ALL_DEVICES = '''
+    WITH svc AS (
+        SELECT device_id, GROUP_CONCAT(port) as ports
+        FROM services
+        GROUP BY device_id
+    ),
+    hist AS (
+        SELECT device_id, COUNT(*) as scan_count
+        FROM device_history
+        GROUP BY device_id
+    )
+    SELECT d.*, svc.ports, COALESCE(hist.scan_count, 0) as scan_count
+    FROM devices d
+    LEFT JOIN svc ON svc.device_id = d.id
+    LEFT JOIN hist ON hist.device_id = d.id
+    ORDER BY d.last_seen DESC
+    LIMIT ?
+'''
+
+_SQL_GET_DEVICE = 'SELECT * FROM devices WHERE id = ?'
+
+_SQL_GET_DEVICE_SERVICES = 'SELECT * FROM services WHERE device_id = ?'
+
+_SQL_GET_DEVICE_HISTORY = '''
+    SELECT * FROM device_history
+    WHERE device_id = ?
+    ORDER BY timestamp DESC
+    LIMIT 20
+'''
+
+# Statistics: every figure in one compound query, one row per value.
+# section names the stats key, label the dict key (or date) and
+# position the order within the section
+_SQL_STATISTICS = '''
+    SELECT 'total_unique_devices' as section, NULL as label, COUNT(*) as count, 0 as position
+    FROM devices
+    UNION ALL
+    SELECT 'recently_active', NULL, COUNT(*), 0
+    FROM devices
+    WHERE last_seen > datetime('now', '-1 day')
+    UNION ALL
+    SELECT 'devices_by_type', device_type, COUNT(*), 0
+    FROM devices
+    GROUP BY device_type
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'top_vendors', vendor, COUNT(*), ROW_NUMBER() OVER (ORDER BY COUNT(*) DESC)
+        FROM devices
+        WHERE vendor != 'Unknown'
+        GROUP BY vendor
+        ORDER BY COUNT(*) DESC
+        LIMIT 10
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT 'recent_scans', DATE(timestamp), COUNT(*), ROW_NUMBER() OVER (ORDER BY DATE(timestamp) DESC)
+        FROM scan_sessions
+        GROUP BY DATE(timestamp)
+        ORDER BY DATE(timestamp) DESC
+        LIMIT 7
+    )
+    ORDER BY position
+'''
+
+@lru_cache(maxsize=None)
+def _insert_devices_sql(count):
+    """Build (once per row count) the multi-row device upsert statement"""
+    return _SQL_UPSERT_DEVICES.format(values=', '.join([_SQL_DEVICE_VALUES_ROW] * count))
+
+def _split_statements(script):
+    """Split an SQL script into the single statements Connection.execute accepts"""
+    statements = []
+    current = ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    return statements
+
+def _call_if_alive(method_ref):
+    """Call the method behind a WeakMethod unless its object is gone"""
+    method = method_ref()
+    if method is not None:
+        method()
+
+def _deliver(future, result, error):
+    """Complete a writer Future, ignoring one that is already done"""
+    try:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+    except InvalidStateError:
+        pass
+
+class _ConnectionPool:
+    """LIFO pool of open connections shared between threads"""
+    
+    def __init__(self, connect, size=_POOL_SIZE):
+        self._connect = connect
+        self._size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+        self._abandoned = []
+    
+    def _check_fork(self):
+        """Drop idle connections inherited from the parent after a fork"""
+        if self._pid != os.getpid():
+            # SQLite connections must not be used (or closed) across fork(),
+            # so keep a reference instead of letting them be garbage collected
+            self._abandoned.append(self._idle)
+            self._idle = queue.LifoQueue(maxsize=self._size)
+            self._pid = os.getpid()
+    
+    def get(self):
+        """Take an idle connection, opening a new one if none is available"""
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+    
+    def put(self, conn):
+        """Return a connection to the pool, closing it if the pool is full"""
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
 
 class Database:
     def __init__(self, db_path='network_inventory.db'):
         self.db_path = db_path
+        self._pool = _ConnectionPool(self._connect)
+        # Dashboard query results, keyed by name and tagged with the data
+        # version they were computed from
+        self._cache = {}
+        self._data_version = 0
+        # Scan saves are queued for a single background writer thread
+        self._reset_writer()
+        # Threads don't survive fork(), so a child process needs its own
+        # writer; the queue and lock may also have been copied mid-use
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=partial(_call_if_alive, weakref.WeakMethod(self._reset_writer)))
         self.init_database()
     
     def init_database(self):
-        """Initialize database tables"""
-        with self.get_connection() as conn:
-            # Scan sessions table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS scan_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    network_range TEXT,
-                    total_devices INTEGER,
-                    duration_seconds REAL
-                )
-            ''')
-            
-            # Devices table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS devices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    scan_session_id INTEGER,
-                    ip_address TEXT NOT NULL,
-                    mac_address TEXT,
-                    hostname TEXT,
-                    vendor TEXT,
-                    os_guess TEXT,
-                    device_type TEXT,
-                    status TEXT,
-                    first_seen DATETIME,
-                    last_seen DATETIME,
-                    FOREIGN KEY (scan_session_id) REFERENCES scan_sessions (id)
-                )
-            ''')
-            
-            # Services table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS services (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    device_id INTEGER,
-                    port INTEGER,
-                    service_name TEXT,
-                    version TEXT,
-                    product TEXT,
-                    FOREIGN KEY (device_id) REFERENCES devices (id)
-                )
-            ''')
-            
-            # Device history table for tracking changes
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS device_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    device_id INTEGER,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    ip_address TEXT,
-                    status TEXT,
-                    open_ports TEXT,
-                    FOREIGN KEY (device_id) REFERENCES devices (id)
-                )
-            ''')
-            
-            conn.commit()
+        """Initialize database tables unless the schema is already current"""
+        # This runs at import time, so use a connection of its own instead of
+        # one from the pool that forked worker processes would inherit
+        with closing(self._connect()) as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] >= _SCHEMA_VERSION:
+                return
+            
+            # Take the write lock before looking at the schema, so a second
+            # process starting at the same time waits and then sees the upgrade
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= _SCHEMA_VERSION:
+                    conn.execute('ROLLBACK')
+                    return
+                
+                history_columns = [row['name'] for row in conn.execute('PRAGMA table_info(device_history)')]
+                
+                script = [_SQL_SCHEMA]
+                
+                # A fresh database gets every column from the CREATE TABLE
+                if history_columns:
+                    script.extend(f'ALTER TABLE device_history ADD COLUMN {name} {declaration};'
+                                  for name, declaration in _HISTORY_ADDED_COLUMNS
+                                  if name not in history_columns)
+                
+                # Upgrade databases that predate one row per device
+                if version < 2:
+                    script.append(_SQL_MERGE_DUPLICATE_DEVICES)
+                elif version < 3:
+                    script.append(_SQL_FILL_HISTORY_DETAILS)
+                
+                script.append(_SQL_INDEXES)
+                script.append(f'PRAGMA user_version = {_SCHEMA_VERSION};')
+                
+                # executescript would commit the open transaction first, so
+                # run the statements one by one while holding the lock
+                for statement in _split_statements('\n'.join(script)):
+                    conn.execute(statement)
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+    
+    def _connect(self):
+        """Open a new connection and apply the tuning PRAGMAs"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                               cached_statements=_CACHED_STATEMENTS)
+        conn.row_factory = sqlite3.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
     
     @contextmanager
     def get_connection(self):
-        """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """Context manager borrowing a connection from the pool"""
+        conn = self._pool.get()
         try:
             yield conn
         finally:
-            conn.close()
+            self._pool.put(conn)
     
-    def save_scan_session(self, network_range, devices, duration):
-        """Save a complete scan session to database"""
+    @contextmanager
+    def transaction(self):
+        """Context manager wrapping writes in a BEGIN IMMEDIATE / COMMIT block"""
         with self.get_connection() as conn:
-            # Insert scan session
-            cursor = conn.execute('''
-                INSERT INTO scan_sessions (network_range, total_devices, duration_seconds)
-                VALUES (?, ?, ?)
-            ''', (network_range, len(devices), duration))
-            
-            session_id = cursor.lastrowid
-            
-            # Insert devices and their services
-            for device in devices:
-                # Insert or update device
-                cursor = conn.execute('''
-                    INSERT OR REPLACE INTO devices 
-                    (scan_session_id, ip_address, mac_address, hostname, vendor, os_guess, device_type, status, first_seen, last_seen)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 
-                            COALESCE((SELECT first_seen FROM devices WHERE ip_address = ?), CURRENT_TIMESTAMP),
-                            CURRENT_TIMESTAMP)
-                ''', (session_id, device['ip_address'], device['mac_address'], device['hostname'], 
-                      device['vendor'], device['os_guess'], device['device_type'], device['status'],
-                      device['ip_address']))
-                
-                device_id = cursor.lastrowid
-                if not device_id:
-                    # If it was an UPDATE, get the existing device ID
-                    cursor = conn.execute('SELECT id FROM devices WHERE ip_address = ?', (device['ip_address'],))
-                    result = cursor.fetchone()
-                    device_id = result['id'] if result else None
-                
-                # Save device history
-                open_ports = json.dumps([service['port'] for service in device['services']])
-                conn.execute('''
-                    INSERT INTO device_history (device_id, ip_address, status, open_ports)
-                    VALUES (?, ?, ?, ?)
-                ''', (device_id, device['ip_address'], device['status'], open_ports))
-                
-                # Clear existing services for this device
-                conn.execute('DELETE FROM services WHERE device_id = ?', (device_id,))
-                
-                # Insert new services
-                for service in device['services']:
-                    conn.execute('''
-                        INSERT INTO services (device_id, port, service_name, version, product)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (device_id, service['port'], service['service'], service['version'], service['product']))
-            
-            conn.commit()
-            return session_id
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                # SQLite may already have rolled back (e.g. SQLITE_FULL), and
+                # a failing ROLLBACK would hide the original error
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+    
+    def save_scan_session(self, network_range, devices, duration, wait=True):
+        """Save a scan session via the writer thread; returns its id, or a Future if wait=False"""
+        future = Future()
+        self._start_writer()
+        self._write_queue.put((network_range, devices, duration, future))
+        if not wait:
+            return future
+        try:
+            return future.result(timeout=_SAVE_TIMEOUT)
+        except TimeoutError:
+            # A save still waiting in the queue can be withdrawn, but one the
+            # writer has already started will be committed, so wait for it
+            if future.cancel():
+                raise
+            return future.result()
+    
+    def _reset_writer(self):
+        """Set up an empty write queue; the writer thread starts on first save"""
+        self._write_queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+    
+    def _start_writer(self):
+        """Start the writer thread on first use"""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+                self._writer.start()
+    
+    def _writer_loop(self):
+        """Drain queued scan saves, committing each batch in one transaction"""
+        while True:
+            jobs = [self._write_queue.get()]
+            while len(jobs) < _WRITE_BATCH:
+                try:
+                    jobs.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # Skip saves whose caller cancelled the Future while it was queued
+            jobs = [job for job in jobs if job[3].set_running_or_notify_cancel()]
+            if not jobs:
+                continue
+            
+            results = []
+            try:
+                with self.transaction() as conn:
+                    for network_range, devices, duration, future in jobs:
+                        # A savepoint per scan keeps one bad scan from
+                        # discarding the others in the batch
+                        conn.execute('SAVEPOINT save_scan')
+                        try:
+                            session_id = self._write_scan_session(conn, network_range, devices, duration)
+                        except Exception as e:
+                            conn.execute('ROLLBACK TO save_scan')
+                            conn.execute('RELEASE save_scan')
+                            results.append((future, None, e))
+                        else:
+                            conn.execute('RELEASE save_scan')
+                            results.append((future, session_id, None))
+            except Exception as e:
+                for job in jobs:
+                    _deliver(job[3], None, e)
+                continue
+            
+            # Invalidate cached dashboard results
+            self._data_version += 1
+            for future, session_id, error in results:
+                _deliver(future, session_id, error)
+    
+    def _write_scan_session(self, conn, network_range, devices, duration):
+        """Write one scan session and its devices on conn, returning the session id"""
+        # Insert scan session
+        cursor = conn.execute(_SQL_INSERT_SCAN_SESSION, (network_range, len(devices), duration))
+        
+        session_id = cursor.lastrowid
+        
+        # Insert or update devices in multi-row batches, collecting their ids
+        device_rows = [(session_id,) + device[:7] for device in devices]
+        device_ids = {}
+        for start in range(0, len(device_rows), _DEVICE_INSERT_BATCH):
+            batch = device_rows[start:start + _DEVICE_INSERT_BATCH]
+            params = [value for row in batch for value in row]
+            cursor = conn.execute(_insert_devices_sql(len(batch)), params)
+            device_ids.update((row['ip_address'], row['id']) for row in cursor.fetchall())
+        
+        history_rows = []
+        service_rows = []
+        for device in devices:
+            device_id = device_ids.get(device.ip_address)
+            open_ports = orjson.dumps([service[0] for service in device.services]).decode()
+            history_rows.append((device_id, device.ip_address, device.status, open_ports, session_id,
+                                 device.mac_address, device.hostname, device.vendor, device.os_guess,
+                                 device.device_type))
+            service_rows.extend((device_id,) + tuple(service) for service in device.services)
+        
+        # Save device history
+        conn.executemany(_SQL_INSERT_DEVICE_HISTORY, history_rows)
+        
+        # Drop services whose port closed with one statement for the whole
+        # scan, then upsert the rest so unchanged services are left untouched
+        conn.execute(_SQL_DELETE_STALE_SERVICES, (
+            orjson.dumps(list(device_ids.values())).decode(),
+            orjson.dumps([row[:2] for row in service_rows]).decode()))
+        conn.executemany(_SQL_UPSERT_SERVICE, service_rows)
+        
+        return session_id
+    
+    def _cached(self, key, compute):
+        """Return a cached result for key, recomputing it when stale"""
+        entry = self._cache.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[0] == self._data_version and now - entry[1] < _CACHE_TTL:
+            return entry[2]
+        version = self._data_version
+        value = compute()
+        self._cache[key] = (version, now, value)
+        return value
     
     def get_scan_sessions(self, limit=10):
         """Get recent scan sessions"""
         with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT * FROM scan_sessions 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            cursor = conn.execute(_SQL_GET_SCAN_SESSIONS, (limit,))
+            return cursor.fetchall()
+    
+    def get_scan_session(self, session_id):
+        """Get a single scan session by id, or None if it does not exist"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(_SQL_GET_SCAN_SESSION, (session_id,))
+            return cursor.fetchone()
     
     def get_devices_from_session(self, session_id):
         """Get all devices from a specific scan session"""
         with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT d.*, GROUP_CONCAT(s.port) as ports
-                FROM devices d
-                LEFT JOIN services s ON d.id = s.device_id
-                WHERE d.scan_session_id = ?
-                GROUP BY d.id
-            ''', (session_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            cursor = conn.execute(_SQL_GET_DEVICES_FROM_SESSION, (session_id,))
+            return cursor.fetchall()
     
-    def get_all_devices(self):
-        """Get the most recent status of all unique devices"""
+    def get_all_devices(self, limit=None):
+        """Get the most recent status of all unique devices, newest first"""
+        return self._cached(('all_devices', limit), lambda: self._query_all_devices(limit))
+    
+    def _query_all_devices(self, limit):
+        """Uncached query behind get_all_devices"""
         with self.get_connection() as conn:
-            cursor = conn.execute('''
-                SELECT d.*, 
-                       (SELECT GROUP_CONCAT(port) FROM services WHERE device_id = d.id) as ports,
-                       (SELECT COUNT(*) FROM device_history WHERE device_id = d.id) as scan_count
-                FROM devices d
-                WHERE d.last_seen = (SELECT MAX(last_seen) FROM devices WHERE ip_address = d.ip_address)
-                ORDER BY d.last_seen DESC
-            ''')
-            return [dict(row) for row in cursor.fetchall()]
+            # SQLite treats a negative LIMIT as no limit
+            cursor = conn.execute(_SQL_GET_ALL_DEVICES, (-1 if limit is None else limit,))
+            return cursor.fetchall()
     
     def get_device_detail(self, device_id):
         """Get detailed information for a specific device"""
         with self.get_connection() as conn:
             # Get device info
-            cursor = conn.execute('SELECT * FROM devices WHERE id = ?', (device_id,))
-            device = dict(cursor.fetchone())
+            cursor = conn.execute(_SQL_GET_DEVICE, (device_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            device = dict(row)
             
             # Get services
-            cursor = conn.execute('SELECT * FROM services WHERE device_id = ?', (device_id,))
-            device['services'] = [dict(row) for row in cursor.fetchall()]
+            cursor = conn.execute(_SQL_GET_DEVICE_SERVICES, (device_id,))
+            device['services'] = cursor.fetchall()
             
             # Get history
-            cursor = conn.execute('''
-                SELECT * FROM device_history 
-                WHERE device_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT 20
-            ''', (device_id,))
-            device['history'] = [dict(row) for row in cursor.fetchall()]
+            cursor = conn.execute(_SQL_GET_DEVICE_HISTORY, (device_id,))
+            device['history'] = cursor.fetchall()
             
             return device
     
     def get_statistics(self):
         """Get various statistics about the network"""
+        return self._cached('statistics', self._query_statistics)
+    
+    def _query_statistics(self):
+        """Uncached queries behind get_statistics"""
+        stats = {
+            'total_unique_devices': 0,
+            'recently_active': 0,
+            'devices_by_type': {},
+            'top_vendors': {},
+            'recent_scans': [],
+        }
         with self.get_connection() as conn:
-            stats = {}
-            
-            # Total devices ever seen
-            cursor = conn.execute('SELECT COUNT(DISTINCT ip_address) as count FROM devices')
-            stats['total_unique_devices'] = cursor.fetchone()['count']
-            
-            # Currently active devices (last 24 hours)
-            cursor = conn.execute('''
-                SELECT COUNT(DISTINCT ip_address) as count 
-                FROM devices 
-                WHERE last_seen > datetime('now', '-1 day')
-            ''')
-            stats['recently_active'] = cursor.fetchone()['count']
-            
-            # Devices by type
-            cursor = conn.execute('''
-                SELECT device_type, COUNT(*) as count 
-                FROM devices 
-                WHERE last_seen = (SELECT MAX(last_seen) FROM devices d2 WHERE d2.ip_address = devices.ip_address)
-                GROUP BY device_type
-            ''')
-            stats['devices_by_type'] = {row['device_type']: row['count'] for row in cursor.fetchall()}
-            
-            # Most common vendors
-            cursor = conn.execute('''
-                SELECT vendor, COUNT(*) as count 
-                FROM devices 
-                WHERE vendor != 'Unknown' 
-                GROUP BY vendor 
-                ORDER BY count DESC 
-                LIMIT 10
-            ''')
-            stats['top_vendors'] = {row['vendor']: row['count'] for row in cursor.fetchall()}
-            
-            # Scan history
-            cursor = conn.execute('''
-                SELECT DATE(timestamp) as date, COUNT(*) as scan_count
-                FROM scan_sessions
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-                LIMIT 7
-            ''')
-            stats['recent_scans'] = [dict(row) for row in cursor.fetchall()]
-            
-            return stats
\ No newline at end of file
+            cursor = conn.execute(_SQL_STATISTICS)
+            for row in cursor.fetchall():
+                section = row['section']
+                if section == 'recent_scans':
+                    stats['recent_scans'].append({'date': row['label'], 'scan_count': row['count']})
+                elif section in ('devices_by_type', 'top_vendors'):
+                    stats[section][row['label']] = row['count']
+                else:
+                    stats[section] = row['count']
+        
+        return stats
@@ -1,26 +1,130 @@
 import nmap
-import pandas as pd
 import socket
-from datetime import datetime
+import sqlite3
 import time
 import os
+import re
+import shutil
+import subprocess
+import threading
+import shlex
+import tempfile
+import ipaddress
+import xml.etree.ElementTree as ET
+from db_manager import DeviceRow
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+_SCAN_WORKERS = 8
+_HOSTS_PER_SCAN = 16
+
+# Vendor name tokens for each device type, in priority order
+_VENDOR_DEVICE_TYPES = (
+    (frozenset(('apple', 'iphone', 'ipad', 'mac')), 'Apple Device'),
+    (frozenset(('samsung', 'android')), 'Android Device'),
+    (frozenset(('raspberry', 'pi')), 'Raspberry Pi'),
+    (frozenset(('amazon', 'echo')), 'Amazon Alexa'),
+    (frozenset(('google', 'nest')), 'Google Smart Device'),
+    (frozenset(('tp-link', 'tplink', 'netgear', 'asus', 'asustek', 'd-link', 'linksys')), 'Network Device'),
+)
+# Every vendor token mapped to the index of its device type above
+_VENDOR_TOKEN_RANK = {token: rank for rank, (tokens, _) in enumerate(_VENDOR_DEVICE_TYPES)
+                      for token in tokens}
+# Hyphenated names are kept whole (tp-link) and also split (cisco-linksys)
+_VENDOR_TOKEN_RE = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+_VENDOR_WORD_RE = re.compile(r'[a-z0-9]+')
+# Bitmasks over well-known ports (below 1024) used to classify devices
+_SSH_MASK = 1 << 22
+_WINDOWS_MASK = (1 << 135) | (1 << 139) | (1 << 445)
+_WEB_MASK = (1 << 80) | (1 << 443)
+
+def _address_key(host):
+    """Sort key that orders IP addresses numerically rather than as strings"""
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return (99, 0, host)
+    return (address.version, int(address), '')
+
+def _chunked(hosts, size):
+    """Yield successive lists of at most size hosts"""
+    hosts = iter(hosts)
+    while chunk := list(islice(hosts, size)):
+        yield chunk
+
+# Where nmap installs its MAC prefix -> vendor table
+_OUI_PATHS = (
+    '/usr/share/nmap/nmap-mac-prefixes',
+    '/usr/local/share/nmap/nmap-mac-prefixes',
+    '/opt/homebrew/share/nmap/nmap-mac-prefixes',
+)
+
+_oui = None
+_oui_lock = threading.Lock()
+
+def _load_oui_table():
+    """Parse nmap's MAC prefix table into a dict keyed by the 24-bit OUI"""
+    for path in _OUI_PATHS:
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        
+        table = {}
+        for line in lines:
+            prefix, _, vendor = line.strip().partition(' ')
+            # Skip comments and the longer MA-M/MA-S prefixes
+            if len(prefix) == 6 and vendor:
+                try:
+                    table[int(prefix, 16)] = vendor
+                except ValueError:
+                    continue
+        return table
+    return {}
+
+def _oui_table():
+    """Return the OUI table, loading it on first use"""
+    global _oui
+    if _oui is None:
+        # Scan workers can all ask at once; only the first parses the file
+        with _oui_lock:
+            if _oui is None:
+                _oui = _load_oui_table()
+    return _oui
+
+def _lookup_vendor(mac):
+    """Resolve a MAC address to its vendor from the OUI table"""
+    try:
+        oui = int(mac.replace(':', '').replace('-', '')[:6], 16)
+    except ValueError:
+        return 'Unknown'
+    return _oui_table().get(oui, 'Unknown')
 
 class NetworkScanner:
     def __init__(self, db):
         self.nm = nmap.PortScanner()
         self.db = db
+        self._local_net = None
     
     def get_local_network(self):
         """Try to automatically detect the local network range"""
+        if self._local_net is not None:
+            return self._local_net
+        
         try:
-            hostname = socket.gethostname()
-            local_ip = socket.gethostbyname(hostname)
-            network_base = '.'.join(local_ip.split('.')[:-1]) + '.0/24'
-            return network_base
-        except:
+            # Connecting a UDP socket sends nothing but picks the outbound
+            # interface, whose address is the one we want
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(('8.8.8.8', 80))
+                local_ip = s.getsockname()[0]
+        except OSError:
             return '192.168.1.0/24'
+        
+        self._local_net = '.'.join(local_ip.split('.')[:-1]) + '.0/24'
+        return self._local_net
     
-    def scan_network(self, network_range=None):
+    def scan_network(self, network_range=None, min_rate=1000):
         """Perform a network scan and save results to database"""
         start_time = time.time()
         
@@ -30,133 +134,229 @@ class NetworkScanner:
         print(f"Starting scan of: {network_range}")
         devices = []
         
+        # python-nmap splits the hosts string like a shell would, so reject
+        # input it can't split (e.g. an unclosed quote) before scanning
         try:
-            # Choose nmap arguments based on privileges:
-            # - If running as root we can use SYN scans and OS detection (-sS, -O)
-            # - If not root, fall back to TCP connect scan (-sT) and service detection (-sV)
-            if hasattr(os, 'geteuid') and os.geteuid() == 0:
-                scan_args = '-sS -O -sV --script=banner -T4'
-                privilege_note = 'running privileged scan (SYN/OS detection)'
-            else:
-                scan_args = '-sT -sV -T4'
-                privilege_note = 'non-root fallback (TCP connect scan)'
+            shlex.split(network_range)
+        except ValueError as e:
+            return self._scan_failed(e)
+        
+        # Choose nmap arguments based on privileges:
+        # - If running as root we can use SYN scans and OS detection (-sS, -O)
+        # - If not root, fall back to TCP connect scan (-sT) and service detection (-sV)
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            scan_args = '-sS -O -sV --script=banner -T4'
+            privilege_note = 'running privileged scan (SYN/OS detection)'
+        else:
+            scan_args = '-sT -sV -T4'
+            privilege_note = 'non-root fallback (TCP connect scan)'
 
-            print(f"Using nmap arguments: {scan_args} ({privilege_note})")
-            self.nm.scan(hosts=network_range, arguments=scan_args)
+        try:
+            # Ping sweep first so the expensive probes only run against live hosts
+            live_hosts = self._discover_live_hosts(network_range, min_rate)
+            print(f"Found {len(live_hosts)} live hosts")
             
-            for host in self.nm.all_hosts():
-                device_info = {
-                    'ip_address': host,
-                    'hostname': self.nm[host].hostname() or 'Unknown',
-                    'mac_address': 'Unknown',
-                    'vendor': 'Unknown',
-                    'status': self.nm[host].state(),
-                    'os_guess': 'Unknown',
-                    'device_type': 'Unknown',
-                    'services': [],
-                    'last_seen': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                # Get MAC address and vendor
-                if 'addresses' in self.nm[host]:
-                    if 'mac' in self.nm[host]['addresses']:
-                        device_info['mac_address'] = self.nm[host]['addresses']['mac']
-                        if 'vendor' in self.nm[host] and device_info['mac_address'] in self.nm[host]['vendor']:
-                            device_info['vendor'] = self.nm[host]['vendor'][device_info['mac_address']]
-                
-                # Get OS information
-                if 'osmatch' in self.nm[host]:
-                    if self.nm[host]['osmatch']:
-                        device_info['os_guess'] = self.nm[host]['osmatch'][0]['name']
+            if live_hosts:
+                # Discovery and name resolution were already done by the sweep;
+                # hold nmap at min_rate and cap retries and time per host
+                scan_args += f' -Pn -n --min-rate {min_rate} --max-retries 2 --host-timeout 90s'
+                print(f"Using nmap arguments: {scan_args} ({privilege_note})")
                 
-                # Get open ports and services
-                if 'tcp' in self.nm[host]:
-                    for port in self.nm[host]['tcp']:
-                        port_info = self.nm[host]['tcp'][port]
-                        if port_info['state'] == 'open':
-                            service_info = {
-                                'port': port,
-                                'service': port_info['name'],
-                                'version': port_info.get('version', 'Unknown'),
-                                'product': port_info.get('product', 'Unknown')
-                            }
-                            device_info['services'].append(service_info)
-                
-                # Infer device type
-                device_info['device_type'] = self._infer_device_type(device_info)
-                devices.append(device_info)
-            
-            duration = time.time() - start_time
-            
-            # Save to database
+                # Scan groups of live hosts in parallel nmap processes
+                with ThreadPoolExecutor(max_workers=_SCAN_WORKERS) as executor:
+                    results = executor.map(lambda chunk: self._scan_chunk(chunk, scan_args, live_hosts),
+                                           _chunked(live_hosts, _HOSTS_PER_SCAN))
+                    for chunk_devices in results:
+                        devices.extend(chunk_devices)
+        except (nmap.PortScannerError, OSError) as e:
+            return self._scan_failed(e)
+        
+        duration = time.time() - start_time
+        
+        # Save to database
+        try:
             session_id = self.db.save_scan_session(network_range, devices, duration)
-            
-            return {
-                'success': True,
-                'session_id': session_id,
-                'devices_found': len(devices),
-                'duration': round(duration, 2),
-                'network_range': network_range
-            }
-            
-        except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'devices_found': 0,
-                'duration': 0
-            }
+        except (sqlite3.Error, TimeoutError) as e:
+            return self._scan_failed(e)
+        
+        return {
+            'success': True,
+            'session_id': session_id,
+            'devices_found': len(devices),
+            'duration': round(duration, 2),
+            'network_range': network_range
+        }
+    
+    def _scan_failed(self, error):
+        """Result returned when nmap or the database fails during a scan"""
+        return {
+            'success': False,
+            'error': str(error),
+            'devices_found': 0,
+            'duration': 0
+        }
+    
+    def _scan_chunk(self, hosts, scan_args, hostnames):
+        """Scan a group of hosts in its own nmap process and return their device rows"""
+        args = ['nmap', '-oX', '-'] + shlex.split(scan_args) + hosts
+        devices = []
+        with tempfile.TemporaryFile() as errors, \
+                subprocess.Popen(args, stdout=subprocess.PIPE, stderr=errors) as proc:
+            try:
+                # nmap writes each <host> element as soon as that host is done,
+                # so parse hosts while the rest of the chunk is still scanning
+                for _, elem in ET.iterparse(proc.stdout):
+                    if elem.tag == 'host':
+                        devices.append(self._parse_host(elem, hostnames))
+                        elem.clear()
+            except ET.ParseError as e:
+                proc.wait()
+                errors.seek(0)
+                message = errors.read().decode(errors='replace').strip()
+                raise nmap.PortScannerError(message or f'Unreadable nmap output: {e}') from e
+        return devices
+    
+    def _parse_host(self, elem, hostnames):
+        """Build the device row for one <host> element of nmap's XML output"""
+        host = None
+        mac_address = 'Unknown'
+        vendor = None
+        os_guess = 'Unknown'
+        
+        # Get IP, MAC address and vendor
+        for address in elem.iterfind('address'):
+            addrtype = address.get('addrtype')
+            if addrtype in ('ipv4', 'ipv6'):
+                host = address.get('addr')
+            elif addrtype == 'mac':
+                mac_address = address.get('addr')
+                vendor = address.get('vendor')
+        if mac_address != 'Unknown' and not vendor:
+            # nmap only names the vendor for some scans, so fall back to the OUI table
+            vendor = _lookup_vendor(mac_address)
+        vendor = vendor or 'Unknown'
+        
+        # Get OS information
+        osmatch = elem.find('os/osmatch')
+        if osmatch is not None:
+            os_guess = osmatch.get('name')
+        
+        # Get open ports and services, building the port mask used to
+        # classify the device in the same pass
+        services = []
+        port_mask = 0
+        for port in elem.iterfind('ports/port'):
+            state = port.find('state')
+            if port.get('protocol') != 'tcp' or state is None or state.get('state') != 'open':
+                continue
+            portid = int(port.get('portid'))
+            if portid < 1024:
+                port_mask |= 1 << portid
+            service = port.find('service')
+            if service is None:
+                services.append((portid, '', '', ''))
+            else:
+                services.append((portid, service.get('name', ''),
+                                 service.get('version', ''), service.get('product', '')))
+        
+        status = elem.find('status').get('state')
+        device_type = self._infer_device_type(vendor.lower(), os_guess.lower(), status, port_mask, bool(services))
+        return DeviceRow(host, mac_address, hostnames.get(host) or 'Unknown', vendor, os_guess,
+                         device_type, status, services)
+    
+    def _discover_live_hosts(self, network_range, min_rate=1000):
+        """Ping sweep the range and map each live host to its hostname"""
+        result = self.nm.scan(hosts=network_range, arguments=f'-sn --min-rate {min_rate}')
+        # Numeric order keeps each scan chunk to a contiguous block of addresses
+        return {host: result['scan'][host].hostname() for host in sorted(result['scan'], key=_address_key)}
     
-    def _infer_device_type(self, device_info):
-        """Infer device type based on available information"""
-        vendor_lower = device_info['vendor'].lower()
-        os_lower = device_info['os_guess'].lower()
-        open_ports = [s['port'] for s in device_info['services']]
-        
-        if any(x in vendor_lower for x in ['apple', 'iphone', 'ipad', 'mac']):
-            return 'Apple Device'
-        elif any(x in vendor_lower for x in ['samsung', 'android']):
-            return 'Android Device'
-        elif any(x in vendor_lower for x in ['raspberry', 'pi']):
-            return 'Raspberry Pi'
-        elif any(x in vendor_lower for x in ['amazon', 'echo']):
-            return 'Amazon Alexa'
-        elif any(x in vendor_lower for x in ['google', 'nest']):
-            return 'Google Smart Device'
-        elif any(x in vendor_lower for x in ['tp-link', 'netgear', 'asus', 'd-link', 'linksys']):
-            return 'Network Device'
-        elif 22 in open_ports and ('linux' in os_lower or not os_lower):
+    def _infer_device_type(self, vendor_lower, os_lower, status, port_mask, has_services):
+        """Infer device type from the lowercased vendor and OS and the open port mask"""
+        # Tokenize the vendor once and match whole words, so e.g. "pi" no
+        # longer matches inside an unrelated vendor name
+        vendor_tokens = set(_VENDOR_TOKEN_RE.findall(vendor_lower))
+        vendor_tokens.update(_VENDOR_WORD_RE.findall(vendor_lower))
+        # One set intersection finds every known token; the lowest rank wins
+        matches = _VENDOR_TOKEN_RANK.keys() & vendor_tokens
+        if matches:
+            return _VENDOR_DEVICE_TYPES[min(_VENDOR_TOKEN_RANK[token] for token in matches)][1]
+        
+        if port_mask & _SSH_MASK and ('linux' in os_lower or not os_lower):
             return 'Linux Server'
-        elif any(port in [135, 139, 445] for port in open_ports):
+        elif port_mask & _WINDOWS_MASK:
             return 'Windows Computer'
-        elif 80 in open_ports or 443 in open_ports:
+        elif port_mask & _WEB_MASK:
             return 'Web Server'
-        elif not open_ports and device_info['status'] == 'up':
+        elif not has_services and status == 'up':
             return 'Generic IoT Device'
         
         return 'Unknown Device'
     
+    def _is_local(self, network_range):
+        """Check whether the range lies inside the directly attached network"""
+        try:
+            return ipaddress.ip_network(network_range, strict=False).subnet_of(
+                ipaddress.ip_network(self.get_local_network()))
+        except (ValueError, TypeError):
+            return False
+    
+    def _arp_scan(self, network_range):
+        """Find active devices on the local network with arp-scan, or None if it can't run"""
+        # arp-scan needs raw sockets, so only try it as root
+        if not (hasattr(os, 'geteuid') and os.geteuid() == 0) or not shutil.which('arp-scan'):
+            return None
+        
+        try:
+            result = subprocess.run(['arp-scan', '--plain', '--ignoredups', network_range],
+                                    capture_output=True, text=True, timeout=30, check=True)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        
+        devices = []
+        for line in result.stdout.splitlines():
+            # Each reply is "ip<TAB>mac<TAB>vendor"
+            fields = line.split('\t')
+            if len(fields) < 2:
+                continue
+            vendor = fields[2] if len(fields) > 2 and fields[2] != '(Unknown)' else None
+            devices.append({
+                'ip': fields[0],
+                'hostname': 'Unknown',
+                'mac': fields[1],
+                'vendor': vendor or _lookup_vendor(fields[1]),
+                'status': 'up'
+            })
+        # Replies arrive in response order; list them like the nmap path
+        return sorted(devices, key=lambda device: _address_key(device['ip']))
+    
     def quick_scan(self, network_range=None):
         """Quick scan that just finds active devices"""
         if not network_range:
             network_range = self.get_local_network()
         
+        # ARP sweeps the local segment much faster than nmap's ping probes
+        if self._is_local(network_range):
+            devices = self._arp_scan(network_range)
+            if devices is not None:
+                return devices
+        
         self.nm.scan(hosts=network_range, arguments='-sn')
         
         devices = []
-        for host in self.nm.all_hosts():
+        for host in sorted(self.nm.all_hosts(), key=_address_key):
+            h = self.nm[host]
             device = {
                 'ip': host,
-                'hostname': self.nm[host].hostname() or 'Unknown',
+                'hostname': h.hostname() or 'Unknown',
                 'mac': 'Unknown',
                 'vendor': 'Unknown',
-                'status': self.nm[host].state()
+                'status': h.state()
             }
             
-            if 'addresses' in self.nm[host] and 'mac' in self.nm[host]['addresses']:
-                device['mac'] = self.nm[host]['addresses']['mac']
-                if 'vendor' in self.nm[host] and device['mac'] in self.nm[host]['vendor']:
-                    device['vendor'] = self.nm[host]['vendor'][device['mac']]
+            mac = h.get('addresses', {}).get('mac')
+            if mac:
+                device['mac'] = mac
+                device['vendor'] = h.get('vendor', {}).get(mac) or _lookup_vendor(mac)
             
             devices.append(device)
         
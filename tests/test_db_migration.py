@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_manager import Database, DeviceRow, _SCHEMA_VERSION
+
+# Tables as the original release created them: one devices row per IP
+# per scan and no session or device details on device_history
+BASELINE_SCHEMA = '''
+    CREATE TABLE scan_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        network_range TEXT,
+        total_devices INTEGER,
+        duration_seconds REAL
+    );
+    CREATE TABLE devices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_session_id INTEGER,
+        ip_address TEXT NOT NULL,
+        mac_address TEXT,
+        hostname TEXT,
+        vendor TEXT,
+        os_guess TEXT,
+        device_type TEXT,
+        status TEXT,
+        first_seen DATETIME,
+        last_seen DATETIME,
+        FOREIGN KEY (scan_session_id) REFERENCES scan_sessions (id)
+    );
+    CREATE TABLE services (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id INTEGER,
+        port INTEGER,
+        service_name TEXT,
+        version TEXT,
+        product TEXT,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    );
+    CREATE TABLE device_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        ip_address TEXT,
+        status TEXT,
+        open_ports TEXT,
+        FOREIGN KEY (device_id) REFERENCES devices (id)
+    );
+'''
+
+
+class BaselineMigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'baseline.db')
+        conn = sqlite3.connect(self.path)
+        conn.executescript(BASELINE_SCHEMA)
+        # Two scans of the same IP whose hostname, vendor, OS and type changed,
+        # written the way the original save_scan_session wrote them
+        scans = [
+            ('2024-01-01 10:00:00', 'old-host', 'OldVendor', 'Linux 4.x', 'Linux Server', '[22]'),
+            ('2024-02-01 10:00:00', 'new-host', 'NewVendor', 'Linux 5.x', 'Web Server', '[22, 80]'),
+        ]
+        for session_id, (ts, hostname, vendor, os_guess, device_type, ports) in enumerate(scans, 1):
+            conn.execute('INSERT INTO scan_sessions (id, timestamp, network_range, total_devices, duration_seconds) '
+                         'VALUES (?, ?, ?, 1, 1.0)', (session_id, ts, '10.0.0.0/24'))
+            cursor = conn.execute('INSERT INTO devices (scan_session_id, ip_address, mac_address, hostname, vendor, '
+                                  'os_guess, device_type, status, first_seen, last_seen) '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  (session_id, '10.0.0.5', 'aa:bb:cc:dd:ee:0%d' % session_id, hostname, vendor,
+                                   os_guess, device_type, 'up', ts, ts))
+            conn.execute('INSERT INTO device_history (device_id, timestamp, ip_address, status, open_ports) '
+                         'VALUES (?, ?, ?, ?, ?)', (cursor.lastrowid, ts, '10.0.0.5', 'up', ports))
+            conn.execute('INSERT INTO services (device_id, port, service_name, version, product) '
+                         'VALUES (?, 22, ?, ?, ?)', (cursor.lastrowid, 'ssh', '1.%d' % session_id, 'OpenSSH'))
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sessions_keep_what_each_scan_saw(self):
+        db = Database(self.path)
+        first = [dict(row) for row in db.get_devices_from_session(1)]
+        second = [dict(row) for row in db.get_devices_from_session(2)]
+
+        self.assertEqual(len(first), 1)
+        self.assertEqual((first[0]['hostname'], first[0]['vendor'], first[0]['os_guess'],
+                          first[0]['device_type'], first[0]['mac_address'], first[0]['ports']),
+                         ('old-host', 'OldVendor', 'Linux 4.x', 'Linux Server', 'aa:bb:cc:dd:ee:01', '22'))
+        self.assertEqual((second[0]['hostname'], second[0]['vendor'], second[0]['device_type'], second[0]['ports']),
+                         ('new-host', 'NewVendor', 'Web Server', '22,80'))
+        self.assertEqual(first[0]['last_seen'], '2024-01-01 10:00:00')
+
+    def test_devices_merged_into_latest_row(self):
+        db = Database(self.path)
+        devices = db.get_all_devices()
+
+        self.assertEqual(len(devices), 1)
+        device = db.get_device_detail(devices[0]['id'])
+        self.assertEqual(device['hostname'], 'new-host')
+        self.assertEqual(device['first_seen'], '2024-01-01 10:00:00')
+        self.assertEqual(len(device['history']), 2)
+        self.assertEqual([tuple(service)[2:] for service in device['services']], [(22, 'ssh', '1.2', 'OpenSSH')])
+
+    def test_upgrade_runs_once(self):
+        Database(self.path)
+        db = Database(self.path)
+        with db.get_connection() as conn:
+            self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], _SCHEMA_VERSION)
+        self.assertEqual(len(db.get_devices_from_session(1)), 1)
+
+    def test_new_scans_record_device_details(self):
+        db = Database(self.path)
+        session_id = db.save_scan_session('10.0.0.0/24', [
+            DeviceRow('10.0.0.5', 'aa:bb:cc:dd:ee:03', 'newest-host', 'Vendor3', 'Linux 6.x', 'Linux Server',
+                      'up', [(22, 'ssh', '2.0', 'OpenSSH')]),
+        ], 1.0)
+
+        self.assertEqual(db.get_devices_from_session(session_id)[0]['hostname'], 'newest-host')
+        self.assertEqual(db.get_devices_from_session(1)[0]['hostname'], 'old-host')
+
+
+if __name__ == '__main__':
+    unittest.main()